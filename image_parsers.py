@@ -1,70 +1,211 @@
+import csv
 import os
+import queue
+import shutil
+import tempfile
+import threading
 import uuid
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 
 import cv2
-import pandas as pd
-from PIL import Image
-from facenet_pytorch import MTCNN
-
+import numpy as np
 from tqdm import tqdm
 
+from utils import peak_memory_mb
+from video_decoders import FULL_FRAME, LEFT_HALF, RIGHT_HALF, create_decoder, crop_frame
+
+
+# Область кадра в долях ширины и высоты (left, top, right, bottom), метка deepfake и папка для лиц из нее
+Region = namedtuple('Region', ['roi', 'deepfake', 'output_dir'])
+
+# Канонические положения глаз, носа и уголков рта (порядок точек MTCNN) для лица 112x112
+FACE_TEMPLATE = np.array([
+    [38.2946, 51.6963],
+    [73.5318, 51.5014],
+    [56.0252, 71.7366],
+    [41.5493, 92.3655],
+    [70.7299, 92.2041],
+], dtype=np.float32)
+
 
 class SaveMixin:
     @staticmethod
     def save(face_image, video_name: str, output_dir):
-        face_filename = f"{video_name.rstrip('.mp4')}_{uuid.uuid4()}.jpg"
+        face_filename = f"{os.path.splitext(video_name)[0]}_{uuid.uuid4()}.jpg"
 
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir)
+        # exist_ok: области кадра сохраняются из разных потоков
+        os.makedirs(output_dir, exist_ok=True)
         cv2.imwrite(os.path.join(output_dir, face_filename), face_image)
         return face_filename
 
 
-class BaseExtractor(SaveMixin):
+class AlignMixin:
+    @staticmethod
+    def align_faces(faces, landmarks, face_size: int):
+        # Преобразования подобия (поворот, масштаб, сдвиг) для всех лиц пачки считаются одновременно:
+        # точки представлены комплексными числами, и для каждого лица решается задача наименьших квадратов
+        template = FACE_TEMPLATE * (face_size / 112)
+        src = np.asarray(landmarks, dtype=np.float64)
+        src = src[..., 0] + 1j * src[..., 1]
+        dst = template[:, 0] + 1j * template[:, 1]
+
+        src_mean = src.mean(axis=1, keepdims=True)
+        dst_mean = dst.mean()
+        src_centered, dst_centered = src - src_mean, dst - dst_mean
+        rotation = (np.conj(src_centered) * dst_centered).sum(axis=1) / (np.abs(src_centered) ** 2).sum(axis=1)
+        shift = dst_mean - rotation * src_mean[:, 0]
+
+        matrices = np.stack([
+            np.stack([rotation.real, -rotation.imag, shift.real], axis=1),
+            np.stack([rotation.imag, rotation.real, shift.imag], axis=1),
+        ], axis=1)
+
+        return [cv2.warpAffine(face, matrix, (face_size, face_size), flags=cv2.INTER_LINEAR,
+                               borderMode=cv2.BORDER_REPLICATE)
+                for face, matrix in zip(faces, matrices)]
+
+
+class BaseExtractor(SaveMixin, AlignMixin):
+    # Одна модель MTCNN на процесс. Она (и вместе с ней torch) загружается только при первой проверке лица
+    mtcnn = None
+    mtcnn_lock = threading.Lock()
+
     def __init__(self, video_path: str, video_name: str, output_dir: str, deepfake: bool, crop_image: bool = False,
-                 frame_skip: int = 10):
+                 frame_skip: int = 10, regions: list = None, decoder: str = 'opencv', decoder_threads: int = 0,
+                 face_size: int = 0, queue_size: int = 8, rows_chunk_size: int = 1000):
         self.crop_image = crop_image
         self.video_name = video_name
         self.frame_skip = frame_skip
         self.video_path = video_path
         self.output_dir = output_dir
         self.is_deepfake = deepfake
-        self.faces_df = pd.DataFrame(columns=["filepath", "deepfake"])
+
+        # Записи о лицах копятся в памяти только до rows_chunk_size, затем дописываются во временный CSV
+        self.rows_chunk_size = rows_chunk_size
+        self.face_rows = []
+        self.rows_file = None
+        self.faces_lock = threading.Lock()
+        # Сколько декодированных кадров может одновременно находиться в памяти. Без единого буфера
+        # поток декодирования и обработка ждали бы друг друга вечно
+        if queue_size < 1:
+            raise ValueError(f"Размер очереди кадров должен быть не меньше 1: {queue_size}")
+        self.queue_size = queue_size
+        self.decode_error = None
+
+        # Без явно заданных областей обрабатывается весь кадр (или его правая половина) с общей меткой
+        if regions is None:
+            roi = RIGHT_HALF if self.is_deepfake and self.crop_image else FULL_FRAME
+            regions = [Region(roi, self.is_deepfake, self.output_dir)]
+        self.regions = regions
+        self.decoder = decoder
+        self.decoder_threads = decoder_threads
+        # Размер выровненного квадратного лица. 0 - лица сохраняются без выравнивания, как есть
+        if face_size < 0:
+            raise ValueError(f"Размер лица не может быть отрицательным: {face_size}")
+        self.face_size = face_size
 
     def process_video(self):
-        video_capture = cv2.VideoCapture(self.video_path)
-        total_frames = int(video_capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        regions = self.regions
+        decoder_roi = None
+        # Единственную область обрезает сам декодер, а обработчик получает уже готовый кадр
+        if len(regions) == 1:
+            decoder_roi = regions[0].roi
+            regions = [regions[0]._replace(roi=FULL_FRAME)]
+
+        video_capture = create_decoder(self.decoder, self.video_path, decoder_roi, threads=self.decoder_threads,
+                                       frame_skip=self.frame_skip)
+        # Для потоковых MP4 количество кадров часто неизвестно или неверно, оно нужно только для прогресса
+        total_frames = video_capture.frame_count or None
         frame_count, total_faces = 0, 0
 
-        if self.crop_image:
+        if len(regions) > 1:
+            print(f'Кадр будет разделен на {len(regions)} области')
+        elif self.crop_image:
             print('Изображение будет обрезано')
 
-        with tqdm(total=total_frames, desc="Обработка кадров", unit="кадров") as pbar:
-            while True:
-                ret, frame = video_capture.read()
+        # Каждый кадр декодируется один раз, а области обрабатываются параллельно
+        executor = ThreadPoolExecutor(max_workers=len(regions)) if len(regions) > 1 else None
+
+        # Кадры декодируются в отдельном потоке в ограниченный набор буферов, которые переиспользуются:
+        # пока обрабатывается один кадр, декодируется следующий, а память не растет с длиной видео
+        free_buffers, ready_frames = queue.Queue(), queue.Queue()
+        for _ in range(self.queue_size):
+            free_buffers.put(None)
+        stop_decoding = threading.Event()
+        decoder_thread = threading.Thread(
+            target=self.decode_frames, args=(video_capture, free_buffers, ready_frames, stop_decoding), daemon=True)
+        decoder_thread.start()
+
+        try:
+            with tqdm(total=total_frames, desc="Обработка кадров", unit="кадров") as pbar:
+                while True:
+                    frame_count, frame = ready_frames.get()
+                    pbar.update(frame_count - pbar.n)
+                    if frame is None:
+                        print("Все кадры обработаны, завершаем.")
+                        break
+
+                    if executor is None:
+                        region = regions[0]
+                        total_faces = self.on_frame(total_frames, frame_count, total_faces,
+                                                    self.get_region(frame, region.roi), region)
+                    else:
+                        total_faces += sum(executor.map(
+                            lambda reg: self.on_frame(total_frames, frame_count, 0,
+                                                      self.get_region(frame, reg.roi), reg),
+                            regions
+                        ))
+                    pbar.set_postfix({'Найдено лиц': total_faces})
+                    free_buffers.put(frame)
+        finally:
+            stop_decoding.set()
+            free_buffers.put(None)
+            decoder_thread.join()
+            if executor is not None:
+                executor.shutdown()
+            video_capture.release()
+
+        if self.decode_error is not None:
+            raise self.decode_error
+        summary = f"Кадров: {frame_count}, найдено лиц: {total_faces}"
+        peak_memory = peak_memory_mb()
+        if peak_memory is not None:
+            summary += f", пиковое потребление памяти: {peak_memory:.0f} МБ"
+        print(summary)
+
+    def decode_frames(self, video_capture, free_buffers, ready_frames, stop_decoding):
+        # В очередь попадают пары (номер кадра, кадр). Кадр None означает конец видео.
+        # Пропуск кадров выполняет сам декодер
+        try:
+            while not stop_decoding.is_set():
+                buffer = free_buffers.get()
+                if stop_decoding.is_set():
+                    break
+                ret, frame = video_capture.read(buffer)
                 if not ret:
-                    print("Все кадры обработаны, завершаем.")
                     break
+                ready_frames.put((video_capture.frame_index, frame))
+        except Exception as err:
+            self.decode_error = err
+        ready_frames.put((video_capture.frames_read, None))
 
-                if frame_count % self.frame_skip == 0:
-                    if self.is_deepfake and self.crop_image:
-                        frame = self.get_right_half(frame)
-
-                    total_faces = self.on_frame(total_frames, frame_count, total_faces, frame)
-                    pbar.set_postfix({'Найдено лиц': total_faces})
-
-                frame_count += 1
-                pbar.update(1)
-
-        video_capture.release()
+    def params_key(self):
+        # Параметры, от которых зависит результат извлечения. Папки и бэкенд декодирования на него не влияют
+        regions = [(region.roi, region.deepfake) for region in self.regions]
+        return f"{type(self).__name__}:{self.frame_skip}:{regions}:{self.face_size}"
 
-    def on_frame(self, total_frames, frame_count, total_faces, frame):
+    def on_frame(self, total_frames, frame_count, total_faces, frame, region):
         raise NotImplementedError('Не переопределен метод on_frame')
 
     @staticmethod
-    def get_right_half(frame):
-        width = frame.shape[1]
-        return frame[:, width // 2:]
+    def comparison_regions(output_dir):
+        # Видео-сравнение: слева оригинал, справа дипфейк
+        return [Region(LEFT_HALF, False, output_dir), Region(RIGHT_HALF, True, output_dir)]
+
+    @staticmethod
+    def get_region(frame, roi):
+        return crop_frame(frame, roi)
 
     @staticmethod
     def adjust_face_size(frame, face_location):
@@ -78,50 +219,98 @@ class BaseExtractor(SaveMixin):
 
         return frame[top:bottom, left:right]
 
-    @staticmethod
-    def validate_face(face):
-        mtcnn = MTCNN()
+    @classmethod
+    def get_mtcnn(cls):
+        with cls.mtcnn_lock:
+            if cls.mtcnn is None:
+                from facenet_pytorch import MTCNN
+                cls.mtcnn = MTCNN()
+        return cls.mtcnn
+
+    @classmethod
+    def validate_face(cls, face, landmarks=False):
+        from PIL import Image
         image = Image.fromarray(cv2.cvtColor(face, cv2.COLOR_BGR2RGB))
-        boxes, _ = mtcnn.detect(image)
-        return boxes
-
-    def record_face_data(self, face_path):
-        self.faces_df = pd.concat(
-            [self.faces_df, pd.DataFrame({"filepath": [face_path], "deepfake": [self.is_deepfake]})]
-        )
+        boxes, _, points = cls.get_mtcnn().detect(image, landmarks=True)
+        return (boxes, points) if landmarks else boxes
+
+    def normalize_faces(self, faces, landmarks):
+        if not self.face_size or not faces:
+            return faces
+        return self.align_faces(faces, landmarks, self.face_size)
+
+    def record_face_data(self, face_path, deepfake=None):
+        deepfake = self.is_deepfake if deepfake is None else deepfake
+        with self.faces_lock:
+            self.face_rows.append((face_path, deepfake))
+            if len(self.face_rows) >= self.rows_chunk_size:
+                self.flush_face_data()
+
+    def flush_face_data(self):
+        if self.rows_file is None:
+            fd, self.rows_file = tempfile.mkstemp(suffix='.csv')
+            with os.fdopen(fd, 'w', newline='') as file:
+                csv.writer(file).writerow(["filepath", "deepfake"])
+
+        with open(self.rows_file, 'a', newline='') as file:
+            csv.writer(file).writerows(self.face_rows)
+        self.face_rows = []
 
     def save_face_data(self, temp_csv_path):
-        self.faces_df.to_csv(temp_csv_path, index=False)
+        with self.faces_lock:
+            self.flush_face_data()
+        shutil.move(self.rows_file, temp_csv_path)
+        self.rows_file = None
         print("Обработка видео завершена.")
 
 
 class HaarcascadesExtractor(BaseExtractor):
     def __init__(self, video_path: str, video_name: str, output_dir: str, deepfake: bool, crop_image: bool = False,
-                 frame_skip: int = 7):
-        super().__init__(video_path, video_name, output_dir, deepfake, crop_image, frame_skip)
-        self.face_classifier = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-
-    def on_frame(self, total_frames, frame_count, total_faces, frame):
+                 frame_skip: int = 7, regions: list = None, decoder: str = 'opencv', decoder_threads: int = 0,
+                 face_size: int = 0, queue_size: int = 8, rows_chunk_size: int = 1000):
+        super().__init__(video_path, video_name, output_dir, deepfake, crop_image, frame_skip, regions,
+                         decoder, decoder_threads, face_size, queue_size, rows_chunk_size)
+        self.local = threading.local()
+
+    @property
+    def face_classifier(self):
+        # CascadeClassifier не потокобезопасен, поэтому у каждого потока обработки свой экземпляр
+        if not hasattr(self.local, 'face_classifier'):
+            self.local.face_classifier = cv2.CascadeClassifier(
+                cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+        return self.local.face_classifier
+
+    def on_frame(self, total_frames, frame_count, total_faces, frame, region):
         face_locations = self.extract_faces_from_frame(frame)
+        faces, landmarks = [], []
         for coords in face_locations:
             face_image = self.adjust_face_size(frame, coords)
 
             # Дополнительная проверка на минимальное разрешение картинки и наличие
             # на ней лица (Отсеивает почти весь мусор)
-            if face_image is None or self.validate_face(face_image) is None:
+            if face_image is None:
                 continue
+            boxes, points = self.validate_face(face_image, landmarks=True)
+            if boxes is None:
+                continue
+
+            faces.append(face_image)
+            # MTCNN возвращает лица по убыванию размера, выравниваем по самому крупному
+            landmarks.append(points[0])
 
-            face_filename = self.save(face_image, self.video_name, self.output_dir)
-            self.record_face_data(face_filename)
+        for face_image in self.normalize_faces(faces, landmarks):
+            face_filename = self.save(face_image, self.video_name, region.output_dir)
+            self.record_face_data(face_filename, region.deepfake)
 
             total_faces += 1
 
         return total_faces
 
     def extract_faces_from_frame(self, frame):
-        gray_img = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        # Буфер серого изображения переиспользуется, пока размер кадра не меняется
+        self.local.gray_img = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=getattr(self.local, 'gray_img', None))
         faces = self.face_classifier.detectMultiScale(
-            gray_img,
+            self.local.gray_img,
             scaleFactor=1.1,
             minNeighbors=5,
             minSize=(150, 150)
@@ -1,39 +1,104 @@
 import os
 import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
 import pandas as pd
 
 
 class FaceCleanup:
-    def __init__(self, temp_csv, raw_faces_dir, final_csv, result_dir):
+    def __init__(self, temp_csv, raw_faces_dir, final_csv, result_dir, max_workers=8):
         self.temp_csv = temp_csv
         self.raw_faces_dir = raw_faces_dir
         self.final_csv = final_csv
         self.result_dir = result_dir
+        self.max_workers = max_workers
+        # Манифест незавершенного переноса. Пока он существует, файлы и meta.csv могут быть рассинхронизированы
+        self.manifest_file = f"{final_csv}.pending"
 
     def cleanup_faces(self):
+        # Если предыдущий запуск был прерван, сначала доводим его до конца
+        self.recover()
+
         temp_faces_df = pd.read_csv(self.temp_csv)
 
-        temp_faces_df = temp_faces_df[
-            temp_faces_df['filepath'].apply(lambda x: os.path.exists(os.path.join(self.raw_faces_dir, x)))]
+        # Один проход по папке вместо os.path.exists на каждую строку
+        with os.scandir(self.raw_faces_dir) as entries:
+            raw_files = {entry.name for entry in entries if entry.is_file()}
+        temp_faces_df = temp_faces_df[temp_faces_df['filepath'].isin(raw_files)]
 
         if not os.path.exists(self.result_dir):
             os.makedirs(self.result_dir)
 
-        for face_file in temp_faces_df['filepath']:
-            shutil.move(os.path.join(self.raw_faces_dir, face_file), os.path.join(self.result_dir, face_file))
-
-        # Обновление значений в столбце 'filepath' путем добавления префикса
-        temp_faces_df['filepath'] = temp_faces_df['filepath'].apply(lambda x: os.path.join(self.result_dir, x))
+        manifest_df = pd.DataFrame({
+            'source': temp_faces_df['filepath'].apply(lambda x: os.path.join(self.raw_faces_dir, x)),
+            # Обновление значений в столбце 'filepath' путем добавления префикса
+            'filepath': temp_faces_df['filepath'].apply(lambda x: os.path.join(self.result_dir, x)),
+            'deepfake': temp_faces_df['deepfake'],
+        })
+        self.write_csv_atomic(manifest_df, self.manifest_file)
 
-        self.update_permanent_csv(temp_faces_df)
+        self.commit(manifest_df)
         os.remove(self.temp_csv)
         print("Очистка и перенос файлов завершены.")
+        return len(manifest_df)
+
+    def recover(self):
+        if not os.path.exists(self.manifest_file):
+            return
+
+        print(f"Найден незавершенный перенос {self.manifest_file}, восстанавливаем.")
+        manifest_df = pd.read_csv(self.manifest_file)
+
+        # Файл, которого нет ни в источнике, ни в назначении, был удален вручную - запись о нем не нужна
+        moved = manifest_df['filepath'].apply(os.path.exists)
+        pending = manifest_df['source'].apply(os.path.exists)
+        manifest_df = manifest_df[moved | pending]
+
+        self.commit(manifest_df)
+
+    def commit(self, manifest_df):
+        self.move_files(manifest_df)
+        self.update_permanent_csv(manifest_df[['filepath', 'deepfake']])
+        os.remove(self.manifest_file)
+
+    def move_files(self, manifest_df):
+        moves = [(src, dst) for src, dst in zip(manifest_df['source'], manifest_df['filepath'])
+                 if os.path.exists(src)]
+        if not moves:
+            return
+
+        if self.same_filesystem(self.raw_faces_dir, self.result_dir):
+            # В пределах одной файловой системы перенос - это атомарное переименование
+            for src, dst in moves:
+                os.replace(src, dst)
+        else:
+            # Между файловыми системами перенос - это копирование, его выгодно распараллелить
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                list(executor.map(lambda move: shutil.move(*move), moves))
+
+    @staticmethod
+    def same_filesystem(first_dir, second_dir):
+        return os.stat(first_dir).st_dev == os.stat(second_dir).st_dev
 
     def update_permanent_csv(self, temp_faces_df):
         if os.path.exists(self.final_csv):
             permanent_faces_df = pd.read_csv(self.final_csv)
+            # При восстановлении часть строк уже может быть записана
+            temp_faces_df = temp_faces_df[~temp_faces_df['filepath'].isin(permanent_faces_df['filepath'])]
             permanent_faces_df = pd.concat([permanent_faces_df, temp_faces_df], ignore_index=True)
         else:
             permanent_faces_df = temp_faces_df
-        permanent_faces_df.to_csv(self.final_csv, index=False)
\ No newline at end of file
+        self.write_csv_atomic(permanent_faces_df, self.final_csv)
+
+    @staticmethod
+    def write_csv_atomic(df, path):
+        # Пишем во временный файл рядом с целевым и подменяем его одним переименованием
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', newline='') as file:
+                df.to_csv(file, index=False)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
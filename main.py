@@ -4,6 +4,7 @@ import click
 
 from scripts import Config, script_list
 from utils import safe_prompt
+from video_decoders import decoder_list
 
 
 @click.command()
@@ -15,16 +16,34 @@ from utils import safe_prompt
 @click.option('--photos-dir', default='photos', help='Папка для сохранения итоговых изображений лиц.')
 @click.option('--permanent-csv-file', default='meta.csv', help='CSV файл для хранения данных о лицах.')
 @click.option('--links-file', default='links.txt', help='Файл со ссылками на видео.')
+@click.option('--decoder', default='opencv', type=click.Choice(decoder_list.keys(), case_sensitive=False),
+              help='Бэкенд декодирования видео.')
+@click.option('--decoder-threads', default=0, help='Количество потоков декодирования (0 - автоматически).')
+@click.option('--video-cache-file', default=os.path.join('videos', 'cache.json'),
+              help='Индекс кеша загруженных и обработанных видео.')
+@click.option('--video-cache-size', default=0.0,
+              help='Максимальный размер сохраненных видео в ГБ (0 - без ограничения).')
+@click.option('--face-size', default=0, type=click.IntRange(min=0),
+              help='Выравнивать лица по ключевым точкам и сохранять квадратом этого размера (0 - без выравнивания).')
+@click.option('--frame-queue-size', default=8, type=click.IntRange(min=1),
+              help='Сколько декодированных кадров может одновременно находиться в памяти.')
 def main(normal_video_dir: str,
          deepfake_video_dir: str,
          temp_video_dir: str,
          raw_photos_dir: str,
          photos_dir: str,
          permanent_csv_file: str,
-         links_file: str):
+         links_file: str,
+         decoder: str,
+         decoder_threads: int,
+         video_cache_file: str,
+         video_cache_size: float,
+         face_size: int,
+         frame_queue_size: int):
     config = Config(normal_video_dir, deepfake_video_dir,
                     temp_video_dir, raw_photos_dir, photos_dir,
-                    permanent_csv_file, links_file)
+                    permanent_csv_file, links_file, decoder, decoder_threads,
+                    video_cache_file, video_cache_size, face_size, frame_queue_size)
     script_name = safe_prompt(
         text='\nВыберите, какой скрипт использовать:\n'
         '  manual     - Введите ссылку на YouTube или путь до локального видео вручную\n'
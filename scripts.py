@@ -6,9 +6,8 @@ from collections import namedtuple
 
 import click
 
-from image_parsers import HaarcascadesExtractor
-from image_savers import FaceCleanup
 from utils import safe_prompt
+from video_cache import VideoCache
 from video_loaders import YouTubeVideoDownloader, PreloadedVideoDownloader, LocalVideoDownloader
 
 Config = namedtuple('Config', [
@@ -18,22 +17,44 @@ Config = namedtuple('Config', [
     'raw_photos_dir',
     'photos_dir',
     'permanent_csv_file',
-    'links_file'
+    'links_file',
+    'decoder',
+    'decoder_threads',
+    'video_cache_file',
+    'video_cache_size',
+    'face_size',
+    'frame_queue_size',
 ])
 
 
 class BaseScript:
     def __init__(self, config: Config):
         self.config = config
+        self.cache = VideoCache(config.video_cache_file, int(config.video_cache_size * 1024 ** 3))
 
     def execute_script(self):
         raise NotImplementedError('You must implement this method')
 
-    def process_and_cleanup(self, temp_csv_file, video_downloader, is_deepfake, crop, frame_skip):
-        video_path, video_name = video_downloader.download()
+    def process_and_cleanup(self, temp_csv_file, video_downloader, is_deepfake, crop, frame_skip, split=False):
+        # Извлечение лиц тянет за собой cv2 и pandas, поэтому импортируется только при обработке видео
+        from image_parsers import HaarcascadesExtractor, BaseExtractor
+        from image_savers import FaceCleanup
+
+        video = video_downloader.download()
+        # При разделении кадра лица с обеих половин попадают в одну папку, но с разными метками
+        regions = BaseExtractor.comparison_regions(self.config.raw_photos_dir) if split else None
         face_extractor = HaarcascadesExtractor(
-            video_path, video_name, self.config.raw_photos_dir,
-            is_deepfake, crop, frame_skip)
+            video.path, video.name, self.config.raw_photos_dir,
+            is_deepfake, crop, frame_skip, regions,
+            self.config.decoder, self.config.decoder_threads, self.config.face_size,
+            self.config.frame_queue_size)
+
+        # Повторная обработка того же видео с теми же параметрами дала бы дубликаты лиц
+        params_key = face_extractor.params_key()
+        faces_count = self.cache.get_extraction(video, params_key)
+        if faces_count is not None:
+            print(f"Видео {video.name} уже обработано с такими параметрами, сохранено лиц: {faces_count}")
+            return
 
         face_extractor.process_video()
         face_extractor.save_face_data(temp_csv_file)
@@ -46,7 +67,8 @@ class BaseScript:
 
         cleanup_manager = FaceCleanup(temp_csv_file, self.config.raw_photos_dir,
                                       self.config.permanent_csv_file, full_output_dir)
-        cleanup_manager.cleanup_faces()
+        faces_count = cleanup_manager.cleanup_faces()
+        self.cache.add_extraction(video, params_key, faces_count, comparison=split)
 
     @staticmethod
     def open_folder(path):
@@ -59,6 +81,25 @@ class BaseScript:
         else:
             print(f"Операционная система {platform.system()} не поддерживается.")
 
+    @staticmethod
+    def choose_crop(is_deepfake):
+        # Как правило, обрезать изображение нужно только для дипфейк-видео, в которых производится сравнение
+        # между оригиналом и дипфейком, притом что дипфейк всегда с правой стороны
+        if not is_deepfake:
+            return False, False
+
+        crop = safe_prompt(
+            text='Обрезать изображение так, чтобы осталась только правая половина?',
+            type=click.Choice(['Y', 'N'], case_sensitive=False),
+            default='N',
+        ) == 'Y'
+        split = crop and safe_prompt(
+            text='Сохранить лица с левой половины как обычные?',
+            type=click.Choice(['Y', 'N'], case_sensitive=False),
+            default='N',
+        ) == 'Y'
+        return crop, split
+
     @staticmethod
     def choose_folder():
         folders = {
@@ -107,26 +148,16 @@ class ManualInput(BaseScript):
                     default=10,
                 ) if constant_frame_skip is None else constant_frame_skip
 
-                # Как правило, обрезать изображение нужно только для дипфейк-видео, в которых производится сравнение
-                # между оригиналом и дипфейком, притом что дипфейк всегда с правой стороны
-                if is_deepfake:
-                    crop = safe_prompt(
-                        text='Обрезать изображение так, чтобы осталась только правая половина?',
-                        type=click.Choice(['Y', 'N'], case_sensitive=False),
-                        default='N',
-                    ) == 'Y'
-                else:
-                    crop = False
+                crop, split = self.choose_crop(is_deepfake)
 
-                self.process_and_cleanup(temp_csv_file, video_downloader, is_deepfake, crop, frame_skip)
+                self.process_and_cleanup(temp_csv_file, video_downloader, is_deepfake, crop, frame_skip, split)
 
             except Exception as err:
                 print(err)
             finally:
                 print('Начинаем сначала')
 
-    @staticmethod
-    def choose_video_downloader(video_dir):
+    def choose_video_downloader(self, video_dir):
         choice = safe_prompt(
             '\nВыберите источник видео',
             type=click.Choice(['Youtube', 'Local'], case_sensitive=False),
@@ -135,10 +166,10 @@ class ManualInput(BaseScript):
         )
         if choice == 'Youtube':
             youtube_link = safe_prompt('Ссылка на видео', type=str)
-            return YouTubeVideoDownloader(video_dir, youtube_link)
+            return YouTubeVideoDownloader(video_dir, youtube_link, cache=self.cache)
         else:
             video_filename = safe_prompt(f'Введите название видео в папке {video_dir}', type=str)
-            return LocalVideoDownloader(video_dir, video_filename)
+            return LocalVideoDownloader(video_dir, video_filename, cache=self.cache)
 
 
 class LinksInput(BaseScript):
@@ -185,7 +216,9 @@ class LinksInput(BaseScript):
                         os.makedirs(directory)
 
                 temp_csv_file = os.path.join(tempfile.gettempdir(), f"{uuid.uuid4()}.csv")
-                self.process_and_cleanup(temp_csv_file, video_url, is_deepfake, False, frame_skip)
+                video_dir = self.config.deepfake_video_dir if is_deepfake else self.config.normal_video_dir
+                video_downloader = YouTubeVideoDownloader(video_dir, video_url, cache=self.cache)
+                self.process_and_cleanup(temp_csv_file, video_downloader, is_deepfake, False, frame_skip)
 
                 with open(self.config.links_file, 'w') as file:
                     remaining_links = [remain_link for remain_link in links if remain_link != link]
@@ -214,18 +247,12 @@ class DownloadedInput(BaseScript):
             temp_csv_file = os.path.join(tempfile.gettempdir(), f"{uuid.uuid4()}.csv")
             try:
                 video_dir = self.config.deepfake_video_dir if is_deepfake else self.config.normal_video_dir
-                video_downloader = PreloadedVideoDownloader(video_dir, self.config.temp_video_dir)
-
-                if is_deepfake:
-                    crop = safe_prompt(
-                        text='Обрезать изображение так, чтобы осталась только правая половина?',
-                        type=click.Choice(['Y', 'N'], case_sensitive=False),
-                        default='N',
-                    ) == 'Y'
-                else:
-                    crop = False
-
-                self.process_and_cleanup(temp_csv_file, video_downloader, is_deepfake, crop, constant_frame_skip)
+                video_downloader = PreloadedVideoDownloader(video_dir, self.config.temp_video_dir, cache=self.cache)
+
+                crop, split = self.choose_crop(is_deepfake)
+
+                self.process_and_cleanup(temp_csv_file, video_downloader, is_deepfake, crop, constant_frame_skip,
+                                         split)
 
             except Exception as err:
                 print(err)
@@ -1,6 +1,12 @@
 import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
 import pandas as pd
 
+from image_savers import FaceCleanup
+from video_cache import VideoCache
+
 
 class MetaValidator:
     def __init__(self, meta_file: str, images_root: str):
@@ -140,7 +146,179 @@ def append_meta(meta_file, new_meta_file, output_file):
     combined_df.to_csv(output_file, index=False)
 
 
+ConsistencyReport = namedtuple('ConsistencyReport', [
+    'orphan_images',
+    'missing_images',
+    'unused_videos',
+    'label_mismatches',
+    'unlabeled_images',
+])
+
+
+class ConsistencyChecker:
+    image_extensions = ('.jpg', '.jpeg', '.png', '.bmp', '.gif')
+
+    def __init__(self, meta_file: str, images_root: str, videos_root: str, max_workers: int = 16,
+                 video_cache_file: str = None):
+        self.meta_file = meta_file
+        self.images_root = images_root
+        self.videos_root = videos_root
+        self.max_workers = max_workers
+
+        # Видео, обработанные с разделением кадра: для них в папке deepfake допустимы обе метки
+        video_cache_file = video_cache_file or os.path.join(videos_root, 'cache.json')
+        self.comparison_videos = {self.video_key(os.path.splitext(name)[0])
+                                  for name in VideoCache(video_cache_file).comparison_videos()}
+
+        self.meta_df = pd.read_csv(self.meta_file) if os.path.exists(self.meta_file) \
+            else pd.DataFrame(columns=['filepath', 'deepfake'])
+        # Пути в meta.csv могли быть записаны под Windows, поэтому приводим все пути к одному виду
+        self.meta_df['key'] = self.meta_df['filepath'].map(self.normalize_path)
+        self.meta_labels = dict(zip(self.meta_df['key'], self.meta_df['deepfake'].astype(bool)))
+
+        self.images = {}
+        # Видео: ключ для сопоставления с изображениями -> путь к файлу
+        self.deepfake_videos = {}
+        self.normal_videos = {}
+
+    def scan(self):
+        # Изображения: путь -> UUID видео, из которого они извлечены
+        self.images = {
+            self.normalize_path(path): self.extract_video_name(os.path.basename(path))
+            for path in self.scan_files(self.images_root, self.image_extensions)
+        }
+        self.deepfake_videos = self.scan_video_names(os.path.join(self.videos_root, 'deepfake'))
+        self.normal_videos = self.scan_video_names(os.path.join(self.videos_root, 'normal'))
+
+    def check(self):
+        self.scan()
+
+        image_keys = self.images.keys()
+        meta_keys = self.meta_labels.keys()
+
+        used_videos = {self.images[key] for key in image_keys & meta_keys}
+        label_mismatches = {
+            key for key in image_keys & meta_keys
+            if self.allowed_labels(self.images[key]) is not None
+            and self.meta_labels[key] not in self.allowed_labels(self.images[key])
+        }
+        orphan_images = image_keys - meta_keys
+
+        return ConsistencyReport(
+            orphan_images=orphan_images,
+            missing_images=meta_keys - image_keys,
+            unused_videos={path for videos in (self.deepfake_videos, self.normal_videos)
+                           for video_name, path in videos.items() if video_name not in used_videos},
+            label_mismatches=label_mismatches,
+            # Изображения без записи, метку которых нельзя узнать: видео нет ни в одной из папок
+            # или это видео-сравнение, у которого по папке не определить половину кадра
+            unlabeled_images={key for key in orphan_images if self.video_label(self.images[key]) is None},
+        )
+
+    def report(self, output_file=None):
+        report = self.check()
+        print(f"Изображений без записи в meta.csv: {len(report.orphan_images)}")
+        print(f"Записей в meta.csv без изображения: {len(report.missing_images)}")
+        print(f"Неиспользуемых видео: {len(report.unused_videos)}")
+        print(f"Несовпадений метки deepfake: {len(report.label_mismatches)}")
+        print(f"Изображений без записи, метку которых определить нельзя: {len(report.unlabeled_images)}")
+
+        if output_file:
+            with open(output_file, 'w', encoding='utf-8') as f:
+                for name, items in report._asdict().items():
+                    for item in sorted(items):
+                        f.write(f"{name}\t{item}\n")
+        return report
+
+    def fix(self):
+        # Пересобираем meta.csv по файлам на диске. Существующая метка сохраняется, метка из папки видео
+        # используется только для изображений без записи в meta.csv. Изображения, метку которых узнать
+        # нельзя, в meta.csv не попадают - они перечислены в отчете как unlabeled_images
+        report = self.report()
+        rows = []
+        for key, video_name in sorted(self.images.items()):
+            is_deepfake = self.meta_labels.get(key)
+            if is_deepfake is None:
+                is_deepfake = self.video_label(video_name)
+            if is_deepfake is None:
+                continue
+            rows.append({"filepath": key, "deepfake": is_deepfake})
+
+        FaceCleanup.write_csv_atomic(pd.DataFrame(rows, columns=['filepath', 'deepfake']), self.meta_file)
+        print(f"meta.csv пересобран: {len(rows)} записей")
+        return report
+
+    def allowed_labels(self, video_name: str):
+        if video_name in self.deepfake_videos:
+            return {True, False} if video_name in self.comparison_videos else {True}
+        if video_name in self.normal_videos:
+            return {False}
+        return None
+
+    def video_label(self, video_name: str):
+        # У видео-сравнения по папке нельзя понять, с какой половины кадра лицо
+        if video_name in self.comparison_videos:
+            return None
+        if video_name in self.deepfake_videos:
+            return True
+        if video_name in self.normal_videos:
+            return False
+        return None
+
+    def scan_video_names(self, video_dir: str):
+        return {self.video_key(os.path.splitext(os.path.basename(path))[0]): self.normalize_path(path)
+                for path in self.scan_files(video_dir, ('.mp4',))}
+
+    def scan_files(self, root_dir: str, extensions: tuple):
+        if not os.path.isdir(root_dir):
+            return []
+
+        # Файлы верхнего уровня собираем сразу, а подпапки обходим параллельно
+        paths, subdirs = [], []
+        with os.scandir(root_dir) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                elif entry.name.lower().endswith(extensions):
+                    paths.append(entry.path)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for subdir_paths in executor.map(lambda path: self.walk_files(path, extensions), subdirs):
+                paths.extend(subdir_paths)
+        return paths
+
+    @staticmethod
+    def walk_files(root_dir: str, extensions: tuple):
+        paths, stack = [], [root_dir]
+        while stack:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.name.lower().endswith(extensions):
+                        paths.append(entry.path)
+        return paths
+
+    @staticmethod
+    def normalize_path(path: str):
+        return os.path.normpath(path.replace('\\', '/'))
+
+    @classmethod
+    def extract_video_name(cls, image_name: str):
+        return cls.video_key(image_name.split('_')[0])
+
+    @staticmethod
+    def video_key(video_name: str):
+        # Раньше имена изображений строились через rstrip('.mp4'), который срезал и конечные четверки UUID.
+        # Чтобы старые изображения совпадали со своими видео, обе стороны приводятся к одному виду
+        return video_name.rstrip('.mp4')
+
+
 if __name__ == "__main__":
+    checker = ConsistencyChecker('meta.csv', 'photos', 'videos')
+    checker.report('consistency_report.txt')
+    # checker.fix()
+
     # Укажите путь к вашему meta.csv и папке с изображениями
     # meta_file_path = 'meta.csv'
     # images_root_path = 'photos'
@@ -154,12 +332,12 @@ if __name__ == "__main__":
     # checker.report_statistics()
 
     # Укажите путь к файлу с пропущенными изображениями, корневой папке с видео и выходному файлу
-    images_file_path = 'bruh'  # Путь к файлу с пропущенными изображениями
-    videos_root_path = 'videos'  # Путь к папке с видео
-    output_meta_file = 'new_meta.csv'  # Путь к новому файлу meta
-
-    creator = MetaCreator(images_file_path, videos_root_path, output_meta_file)
-    creator.create_new_meta()
+    # images_file_path = 'bruh'  # Путь к файлу с пропущенными изображениями
+    # videos_root_path = 'videos'  # Путь к папке с видео
+    # output_meta_file = 'new_meta.csv'  # Путь к новому файлу meta
+    #
+    # creator = MetaCreator(images_file_path, videos_root_path, output_meta_file)
+    # creator.create_new_meta()
 
     # video_name_input = '6ef065a8-284a-4347-a54a-6d15b2c29ba6'
     # meta_file_path = 'meta.csv'  # Путь к файлу meta.csv
@@ -3,8 +3,8 @@ import sys
 from pathlib import Path
 
 import click
-import pandas as pd
-from tqdm import tqdm
+
+# pandas и tqdm импортируются внутри MetaProcessor: safe_prompt из этого модуля нужен CLI до выбора скрипта
 
 
 def safe_prompt(text, **kwargs):
@@ -15,6 +15,54 @@ def safe_prompt(text, **kwargs):
     return response
 
 
+def peak_memory_mb():
+    # Пиковый объем резидентной памяти процесса. None, если узнать его нельзя
+    if sys.platform == 'win32':
+        return windows_peak_memory_mb()
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux возвращает килобайты, macOS - байты
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+
+
+def windows_peak_memory_mb():
+    import ctypes
+    from ctypes import wintypes
+
+    class ProcessMemoryCounters(ctypes.Structure):
+        # Структура PROCESS_MEMORY_COUNTERS из psapi.h
+        _fields_ = [
+            ('cb', wintypes.DWORD),
+            ('PageFaultCount', wintypes.DWORD),
+            ('PeakWorkingSetSize', ctypes.c_size_t),
+            ('WorkingSetSize', ctypes.c_size_t),
+            ('QuotaPeakPagedPoolUsage', ctypes.c_size_t),
+            ('QuotaPagedPoolUsage', ctypes.c_size_t),
+            ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t),
+            ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+            ('PagefileUsage', ctypes.c_size_t),
+            ('PeakPagefileUsage', ctypes.c_size_t),
+        ]
+
+    try:
+        get_process_memory_info = ctypes.windll.psapi.GetProcessMemoryInfo
+        get_current_process = ctypes.windll.kernel32.GetCurrentProcess
+    except (AttributeError, OSError):
+        return None
+    get_current_process.restype = wintypes.HANDLE
+    get_process_memory_info.argtypes = [wintypes.HANDLE, ctypes.POINTER(ProcessMemoryCounters), wintypes.DWORD]
+    get_process_memory_info.restype = wintypes.BOOL
+
+    counters = ProcessMemoryCounters()
+    counters.cb = ctypes.sizeof(counters)
+    if not get_process_memory_info(get_current_process(), ctypes.byref(counters), counters.cb):
+        return None
+    return counters.PeakWorkingSetSize / 1024 ** 2
+
+
 meta_file = 'meta.csv'
 image_base_path = Path(meta_file).parent
 video_folder = Path('./videos')
@@ -29,6 +77,9 @@ class MetaProcessor:
         self.video_uuids = set()
 
     def process_meta(self):
+        import pandas as pd
+        from tqdm import tqdm
+
         df = pd.read_csv(self.meta_file)
 
         valid_rows = []
@@ -50,6 +101,8 @@ class MetaProcessor:
         print(f"Найдено {undetected_files} отсутствующих файлов")
 
     def clean_videos(self):
+        from tqdm import tqdm
+
         # Удаление видео, не упомянутых в meta.csv
         undetected_files = 0
         video_files = [video for video_dir in self.video_folders for video in Path(video_dir).glob('*.mp4')]
@@ -0,0 +1,146 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+from video_loaders import Video
+
+
+class VideoCache:
+    def __init__(self, index_file: str, max_bytes: int = 0):
+        self.index_file = index_file
+        # 0 - без ограничения размера
+        self.max_bytes = max_bytes
+        # Ключ записи - хеш содержимого видео и папка, в которой оно лежит. Папка задает метку (normal/deepfake),
+        # поэтому одно и то же видео в разных папках - разные записи
+        self.entries = self.load()
+
+    def load(self):
+        if not os.path.exists(self.index_file):
+            return {}
+        try:
+            with open(self.index_file, 'r', encoding='utf-8') as file:
+                entries = json.load(file)
+        except json.JSONDecodeError as err:
+            print(f"Индекс кеша {self.index_file} поврежден ({err}), начинаем с пустого кеша.")
+            return {}
+
+        if not isinstance(entries, dict):
+            print(f"Индекс кеша {self.index_file} поврежден (ожидался объект JSON), начинаем с пустого кеша.")
+            return {}
+        return entries
+
+    def save(self):
+        index_dir = os.path.dirname(os.path.abspath(self.index_file))
+        os.makedirs(index_dir, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=index_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as file:
+                json.dump(self.entries, file, ensure_ascii=False, indent=2)
+            os.replace(temp_path, self.index_file)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    @staticmethod
+    def entry_key(content_hash: str, video_dir: str):
+        return f"{content_hash}:{video_dir}"
+
+    def get_by_source(self, source: str, video_dir: str):
+        # Источник - ссылка или идентификатор видео, по которому его можно найти до загрузки
+        video_dir = os.path.normpath(video_dir)
+        for key, entry in self.entries.items():
+            if (source in entry['sources'] and entry['dir'] == video_dir
+                    and entry['path'] and os.path.exists(entry['path'])):
+                self.touch(key)
+                print(f"Видео {source} уже загружено: {entry['name']}")
+                return Video(entry['path'], entry['name'])
+        return None
+
+    def add(self, video: Video, source: str = None):
+        video_dir = os.path.normpath(os.path.dirname(video.path))
+        content_hash = self.hash_video(video.path)
+        key = self.entry_key(content_hash, video_dir)
+        entry = self.entries.get(key)
+
+        if entry and entry['path'] and entry['path'] != video.path and os.path.exists(entry['path']):
+            # То же самое видео под другим именем в той же папке - оставляем сохраненную копию
+            os.remove(video.path)
+            print(f"Видео {video.name} совпадает с уже сохраненным {entry['name']}, дубликат удален.")
+        else:
+            stat = os.stat(video.path)
+            entry = {
+                **(entry or {'sources': [], 'extractions': {}}),
+                'hash': content_hash,
+                'dir': video_dir,
+                'path': video.path,
+                'name': video.name,
+                'size': stat.st_size,
+                'mtime': stat.st_mtime,
+            }
+            self.entries[key] = entry
+
+        if source and source not in entry['sources']:
+            entry['sources'].append(source)
+        self.touch(key)
+        self.evict(keep=key)
+        self.save()
+        return Video(entry['path'], entry['name'])
+
+    def get_extraction(self, video: Video, params_key: str):
+        key = self.find_key(video)
+        if key is None:
+            return None
+        return self.entries[key]['extractions'].get(params_key)
+
+    def add_extraction(self, video: Video, params_key: str, faces_count: int, comparison: bool = False):
+        key = self.find_key(video)
+        if key is None:
+            return
+        self.entries[key]['extractions'][params_key] = faces_count
+        # Видео-сравнение: лица с левой половины записаны как обычные, хотя видео лежит в папке deepfake
+        if comparison:
+            self.entries[key]['comparison'] = True
+        self.save()
+
+    def comparison_videos(self):
+        return {entry['name'] for entry in self.entries.values() if entry.get('comparison')}
+
+    def find_key(self, video: Video):
+        for key, entry in self.entries.items():
+            if entry['path'] == video.path:
+                return key
+        return None
+
+    def touch(self, key: str):
+        self.entries[key]['last_used'] = time.time()
+
+    def evict(self, keep: str = None):
+        if not self.max_bytes:
+            return
+
+        stored = [(key, entry) for key, entry in self.entries.items() if entry['path']]
+        total_bytes = sum(entry['size'] for _, entry in stored)
+
+        # Удаляем давно не использованные видео. Запись остается, чтобы не обрабатывать видео повторно
+        for key, entry in sorted(stored, key=lambda item: item[1].get('last_used', 0)):
+            if total_bytes <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            if os.path.exists(entry['path']):
+                os.remove(entry['path'])
+            print(f"Видео {entry['name']} удалено из кеша.")
+            total_bytes -= entry['size']
+            entry['path'] = None
+
+    def hash_video(self, video_path: str):
+        # Если файл уже известен и не менялся, хеш не пересчитываем
+        stat = os.stat(video_path)
+        for entry in self.entries.values():
+            if entry['path'] == video_path and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime:
+                return entry['hash']
+
+        with open(video_path, 'rb') as file:
+            return hashlib.file_digest(file, hashlib.blake2b).hexdigest()
@@ -0,0 +1,219 @@
+import os
+import sys
+import time
+
+
+# Область кадра в долях ширины и высоты (left, top, right, bottom)
+FULL_FRAME = (0.0, 0.0, 1.0, 1.0)
+LEFT_HALF = (0.0, 0.0, 0.5, 1.0)
+RIGHT_HALF = (0.5, 0.0, 1.0, 1.0)
+
+
+def crop_frame(frame, roi):
+    if roi is None or roi == FULL_FRAME:
+        return frame
+    height, width = frame.shape[:2]
+    left, top, right, bottom = roi
+    return frame[int(height * top):int(height * bottom), int(width * left):int(width * right)]
+
+
+# Интерфейс повторяет cv2.VideoCapture: read, grab, release.
+# Библиотеки декодирования импортируются внутри бэкендов, чтобы выбор бэкенда в CLI их не загружал
+class VideoDecoder:
+    def __init__(self, video_path: str, roi: tuple = None, scale: float = None, threads: int = 0,
+                 frame_skip: int = 1):
+        self.video_path = video_path
+        self.roi = roi
+        self.scale = scale
+        # 0 - количество потоков выбирает сам декодер
+        self.threads = threads
+        # read отдает только каждый frame_skip-й кадр
+        self.frame_skip = frame_skip
+        # Сколько кадров исходного видео пройдено и номер последнего отданного кадра
+        self.frames_read = 0
+        self.frame_index = -1
+
+    @property
+    def frame_count(self):
+        raise NotImplementedError('Не переопределено свойство frame_count')
+
+    def read(self, frame=None):
+        # frame - заранее выделенный буфер. Если размер подходит, кадр записывается в него без выделения памяти
+        while self.frames_read % self.frame_skip != 0:
+            if not self.skip_frame():
+                return False, None
+            self.frames_read += 1
+
+        ret, frame = self.decode(frame)
+        if ret:
+            self.frame_index = self.frames_read
+            self.frames_read += 1
+        return ret, frame
+
+    def decode(self, frame=None):
+        raise NotImplementedError('Не переопределен метод decode')
+
+    def skip_frame(self):
+        ret, _ = self.decode()
+        return ret
+
+    def release(self):
+        pass
+
+    @staticmethod
+    def fill_buffer(frame, buffer):
+        if buffer is None or buffer.shape != frame.shape:
+            return frame.copy()
+        buffer[...] = frame
+        return buffer
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+
+class OpenCVDecoder(VideoDecoder):
+    def __init__(self, video_path: str, roi: tuple = None, scale: float = None, threads: int = 0,
+                 frame_skip: int = 1):
+        super().__init__(video_path, roi, scale, threads, frame_skip)
+        import cv2
+
+        params = [cv2.CAP_PROP_HW_ACCELERATION, cv2.VIDEO_ACCELERATION_ANY]
+        if threads and hasattr(cv2, 'CAP_PROP_N_THREADS'):
+            params += [cv2.CAP_PROP_N_THREADS, threads]
+        self.video_capture = cv2.VideoCapture(video_path, cv2.CAP_FFMPEG, params)
+
+        # Сборка OpenCV без FFmpeg или без поддержки параметров - открываем со стандартными настройками
+        if not self.video_capture.isOpened():
+            self.video_capture = cv2.VideoCapture(video_path)
+        # Буфер для полного кадра, если результат - только его часть
+        self.full_frame = None
+
+    @property
+    def frame_count(self):
+        import cv2
+        return int(self.video_capture.get(cv2.CAP_PROP_FRAME_COUNT))
+
+    def decode(self, frame=None):
+        if (self.roi is None or self.roi == FULL_FRAME) and not self.scale:
+            return self.video_capture.read(frame)
+
+        ret, self.full_frame = self.video_capture.read(self.full_frame)
+        if not ret:
+            return ret, None
+
+        cropped = crop_frame(self.full_frame, self.roi)
+        if self.scale:
+            import cv2
+            return ret, cv2.resize(cropped, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+        return ret, self.fill_buffer(cropped, frame)
+
+    def skip_frame(self):
+        # Пропускаемый кадр только декодируется, без преобразования в массив
+        return self.video_capture.grab()
+
+    def release(self):
+        self.video_capture.release()
+
+
+# Декодирование бинарником ffmpeg из imageio-ffmpeg: многопоточно, пропуск кадров, обрезка и масштабирование
+# выполняются в ffmpeg, и через канал передаются только нужные кадры
+class FFmpegPipeDecoder(VideoDecoder):
+    def __init__(self, video_path: str, roi: tuple = None, scale: float = None, threads: int = 0,
+                 frame_skip: int = 1):
+        super().__init__(video_path, roi, scale, threads, frame_skip)
+        import imageio_ffmpeg
+
+        self.frames = imageio_ffmpeg.read_frames(
+            video_path,
+            pix_fmt='bgr24',
+            input_params=['-threads', str(threads)],
+            output_params=self.get_filter_params(),
+        )
+        # Первым генератор отдает метаданные, в том числе размер кадра после фильтров
+        self.meta = next(self.frames)
+        self.width, self.height = self.meta['size']
+
+    def get_filter_params(self):
+        filters = []
+        if self.frame_skip > 1:
+            filters.append(f'select=not(mod(n\\,{self.frame_skip}))')
+        if self.roi is not None and self.roi != FULL_FRAME:
+            left, top, right, bottom = self.roi
+            filters.append(f'crop=w=iw*{right - left}:h=ih*{bottom - top}:x=iw*{left}:y=ih*{top}')
+        if self.scale:
+            filters.append(f'scale=w=trunc(iw*{self.scale}):h=trunc(ih*{self.scale})')
+        if not filters:
+            return []
+        # vsync 0: иначе ffmpeg дублирует кадры, чтобы восстановить исходную частоту после select
+        return ['-vf', ','.join(filters), '-vsync', '0']
+
+    @property
+    def frame_count(self):
+        # Количество кадров ffmpeg не сообщает, оцениваем по длительности
+        return int(self.meta.get('duration', 0) * self.meta.get('fps', 0))
+
+    def read(self, frame=None):
+        # Кадры уже прорежены фильтром select, поэтому frames_read растет сразу на frame_skip
+        ret, frame = self.decode(frame)
+        if ret:
+            self.frame_index = self.frames_read
+            self.frames_read += self.frame_skip
+        else:
+            # Сколько кадров в последней неполной группе, не видно. Считаем пройденными кадры до последнего
+            # отданного, чтобы счетчик не превышал длину видео
+            self.frames_read = self.frame_index + 1
+        return ret, frame
+
+    def decode(self, frame=None):
+        import numpy as np
+        try:
+            frame_bytes = next(self.frames)
+        except StopIteration:
+            return False, None
+        return True, self.fill_buffer(np.frombuffer(frame_bytes, dtype=np.uint8).reshape(self.height, self.width, 3),
+                                      frame)
+
+    def release(self):
+        self.frames.close()
+
+
+decoder_list = {
+    'opencv': OpenCVDecoder,
+    'ffmpeg': FFmpegPipeDecoder,
+}
+
+
+def create_decoder(backend: str, video_path: str, roi: tuple = None, scale: float = None, threads: int = 0,
+                   frame_skip: int = 1):
+    if not os.path.exists(video_path):
+        raise FileNotFoundError(f"Видео {video_path} не найдено.")
+    return decoder_list[backend](video_path, roi, scale, threads, frame_skip)
+
+
+def benchmark_decoders(video_path: str, max_frames: int = 1000, roi: tuple = None, scale: float = None,
+                       threads: int = 0):
+    # Сравнение скорости декодирования (кадров в секунду) для всех бэкендов
+    results = {}
+    for backend in decoder_list:
+        with create_decoder(backend, video_path, roi, scale, threads) as decoder:
+            frames = 0
+            start = time.perf_counter()
+            while frames < max_frames:
+                ret, _ = decoder.read()
+                if not ret:
+                    break
+                frames += 1
+            elapsed = time.perf_counter() - start
+
+        results[backend] = frames / elapsed if elapsed else 0.0
+        print(f"{backend:>8}: {frames} кадров за {elapsed:.2f} с - {results[backend]:.1f} кадров/с")
+    return results
+
+
+if __name__ == "__main__":
+    # python video_decoders.py <видео> [кадров]
+    benchmark_decoders(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 1000)
+    benchmark_decoders(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 1000, roi=RIGHT_HALF)
@@ -1,21 +1,25 @@
 import os
+import subprocess
 import uuid
 
-from pytubefix import YouTube
 from collections import namedtuple
-from moviepy.video.io.VideoFileClip import VideoFileClip
 
 
 Video = namedtuple('Video', ['path', 'name'])
 
 
 class VideoDownloader:
-    def __init__(self, output_dir):
+    def __init__(self, output_dir, cache=None):
         self.output_dir = output_dir
+        self.cache = cache
 
     def download(self):
         raise NotImplementedError("Этот метод должен быть реализован в дочернем классе.")
 
+    def register(self, video, source=None):
+        # Одинаковые по содержимому видео хранятся в одном экземпляре
+        return self.cache.add(video, source) if self.cache else video
+
     @staticmethod
     def show_progress(stream, chunk, bytes_remaining):
         total_size = stream.filesize
@@ -25,22 +29,39 @@ class VideoDownloader:
               flush=True)
 
     def trim_video(self, video_path, start_time, end_time):
-        with VideoFileClip(video_path) as video:
-            trimmed_video = video.subclip(start_time, end_time)
-            trimmed_filename = f"{uuid.uuid4()}.mp4"
-            trimmed_path = os.path.join(self.output_dir, trimmed_filename)
-            trimmed_video.write_videofile(trimmed_path, codec="libx264")
+        # Обрезка бинарником ffmpeg из imageio-ffmpeg: видео обрабатывается потоково и не загружается в память
+        import imageio_ffmpeg
+        start_time = start_time or 0
+        trimmed_filename = f"{uuid.uuid4()}.mp4"
+        trimmed_path = os.path.join(self.output_dir, trimmed_filename)
+
+        command = [imageio_ffmpeg.get_ffmpeg_exe(), '-y', '-loglevel', 'error',
+                   '-ss', str(start_time), '-i', video_path]
+        if end_time is not None:
+            command += ['-t', str(end_time - start_time)]
+        command += ['-c:v', 'libx264', '-c:a', 'aac', trimmed_path]
+        subprocess.run(command, check=True)
+
         os.remove(video_path)  # удаляем оригинальное видео
         return trimmed_path
 
 
 class YouTubeVideoDownloader(VideoDownloader):
-    def __init__(self, output_dir, youtube_url, resolution='720p'):
-        super().__init__(output_dir)
+    def __init__(self, output_dir, youtube_url, resolution='720p', cache=None):
+        super().__init__(output_dir, cache)
         self.youtube_url = youtube_url
         self.resolution = resolution
 
     def download(self, start_time=None, end_time=None):
+        # Обрезанное видео отличается от исходного, поэтому по ссылке ищем только целые видео
+        from pytubefix import extract
+        trimmed = start_time is not None or end_time is not None
+        source = None if trimmed else f"youtube:{extract.video_id(self.youtube_url)}"
+        if self.cache and source:
+            video = self.cache.get_by_source(source, self.output_dir)
+            if video:
+                return video
+
         video_stream = self.get_video_stream(self.youtube_url)
 
         print(f"Выбран поток с разрешением: {video_stream.resolution}")
@@ -48,13 +69,14 @@ class YouTubeVideoDownloader(VideoDownloader):
         output_path = os.path.join(self.output_dir, video_filename)
         video_stream.download(output_path=self.output_dir, filename=video_filename)
 
-        if start_time is not None or end_time is not None:
+        if trimmed:
             output_path = self.trim_video(output_path, start_time, end_time)
 
         print(f"\nЗагрузка видео {video_filename} завершена!")
-        return Video(output_path, video_filename)
+        return self.register(Video(output_path, video_filename), source)
 
     def get_video_stream(self, youtube_url):
+        from pytubefix import YouTube
         yt = YouTube(youtube_url, 'MWEB', on_progress_callback=self.show_progress, use_oauth=True)
         streams = yt.streams.filter(adaptive=True, type="video", file_extension='mp4')
 
@@ -75,8 +97,8 @@ class YouTubeVideoDownloader(VideoDownloader):
 
 
 class LocalVideoDownloader(VideoDownloader):
-    def __init__(self, output_dir, video_filename):
-        super().__init__(output_dir)
+    def __init__(self, output_dir, video_filename, cache=None):
+        super().__init__(output_dir, cache)
         self.video_filename = video_filename
         if not os.path.splitext(self.video_filename)[1]:
             self.video_filename += '.mp4'
@@ -90,7 +112,7 @@ class LocalVideoDownloader(VideoDownloader):
 
         if start_time is not None or end_time is not None:
             video_path = self.trim_video(video_path, start_time, end_time)
-        return Video(video_path, self.video_filename)
+        return self.register(Video(video_path, os.path.basename(video_path)))
 
     def handle_duplicate(self, video_path):
         filename, ext = os.path.splitext(video_path)
@@ -106,8 +128,8 @@ class LocalVideoDownloader(VideoDownloader):
 
 
 class PreloadedVideoDownloader(VideoDownloader):
-    def __init__(self, output_dir, temp_dir):
-        super().__init__(output_dir)
+    def __init__(self, output_dir, temp_dir, cache=None):
+        super().__init__(output_dir, cache)
         self.temp_dir = temp_dir
 
     def download(self, start_time=None, end_time=None):
@@ -136,5 +158,5 @@ class PreloadedVideoDownloader(VideoDownloader):
         self.video_filename = new_filename
         print(f"Видео {video_file} переименовано в {new_filename} и перемещено в {self.output_dir}")
 
-        return Video(new_video_path, self.video_filename)
+        return self.register(Video(new_video_path, os.path.basename(new_video_path)))
 